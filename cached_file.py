@@ -0,0 +1,30 @@
+"""Provide cached reading of files which rarely change."""
+
+import copy
+import functools
+import os
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_file(path, parse, mtime_ns, size):
+    """Parse a file, keeping the result of the last few parses.
+
+    The modification time and size of the file aren't used here, but
+    as arguments they're part of the cache key, so changing the file
+    causes it to be parsed again.
+    """
+
+    return parse(path)
+
+def read_cached(path, parse):
+    """Return the result of parse(path), reusing it while the file is unchanged.
+
+    The parse function is given the path of the file, and must be the
+    same function object on every call for its result to be reused.
+    Callers get their own copy of the cached result, so they can change
+    it freely.  If the file doesn't exist, FileNotFoundError is raised.
+    """
+
+    path = os.path.abspath(path)
+    path_stat = os.stat(path)
+    return copy.deepcopy(_parse_file(path, parse, path_stat.st_mtime_ns, path_stat.st_size))
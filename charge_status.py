@@ -4,6 +4,8 @@ This module provides feature-level information about the cars in a user's
 account and actions to take on that information.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 from tesla_connect import TeslaConnect
 
 
@@ -15,24 +17,41 @@ def check_plugin_status_all(config):
     are unplugged.  We only want to do this for cars that are in our home
     location, however, so first we filter the list of vehicles to only contain
     those in our home location.
+
+    Getting the state of a car is a round-trip to the Tesla servers, so
+    rather than waiting on each car in turn we check all of the cars
+    concurrently, in two phases:  first whether each car is at home, then
+    whether each car that is at home is unplugged.  The first phase
+    fetches each car's state, which the second phase reuses, so there is
+    a single wave of one request per car.
     """
 
     tesla_connect = TeslaConnect(config['tesla_connect'])
-    vehicles = tesla_connect.get_vehicles()
+
+    # We don't make a separate mobile-enabled check for each car here:
+    # we're about to request each car's data anyway, and cars whose data
+    # can't be had are treated as neither at home nor unplugged.
+    vehicles = tesla_connect.get_vehicles(check_mobile_enabled=False)
 
     unplugged_vehicles = {}
-    for (vehicle_id, vehicle_name) in vehicles.items():
-        if tesla_connect.is_car_at_home(vehicle_id) is True:
-            if tesla_connect.is_car_unplugged(vehicle_id) is True:
-                unplugged_vehicles[id] = vehicle_name
+    if len(vehicles) == 0:
+        return unplugged_vehicles
+
+    vehicle_ids = list(vehicles)
+    with ThreadPoolExecutor(max_workers=len(vehicle_ids)) as executor:
+        at_home = executor.map(tesla_connect.is_car_at_home, vehicle_ids)
+        at_home_ids = [vehicle_id for (vehicle_id, is_at_home) in zip(vehicle_ids, at_home)
+                       if is_at_home is True]
+
+        unplugged = executor.map(tesla_connect.is_car_unplugged, at_home_ids)
+        for (vehicle_id, is_unplugged) in zip(at_home_ids, unplugged):
+            if is_unplugged is True:
+                unplugged_vehicles[vehicle_id] = vehicles[vehicle_id]
 
     return unplugged_vehicles
 
 def compose_disconnect_message(vehicles):
     """Compose a human-readable message to send out as an alert."""
 
-    message = ''
-    for (_, vehicle_name) in vehicles.items():
-        message += 'Vehicle ' + vehicle_name + ' is disconnected.\n'
-
-    return message
+    return '\n'.join('Vehicle ' + vehicle_name + ' is disconnected.'
+                     for vehicle_name in vehicles.values())
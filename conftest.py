@@ -0,0 +1,9 @@
+"""pytest configuration for the tesla-alert test suite."""
+
+import os
+import sys
+
+# The top-level directory holds an __init__.py, so pytest would otherwise
+# put its parent directory on the module search path, and the tests
+# couldn't import the app modules by their plain names.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -1,8 +1,124 @@
 """Provide email notification support"""
 
+import csv
 import smtplib
 import logging
 import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from email.headerregistry import Address
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+
+from cached_file import read_cached
+
+
+def _parse_emails_file(path):
+    """Read a file of names and email addresses into a dictionary."""
+
+    # Each line is a name and email address separated by a comma.  A
+    # name which itself contains a comma can be given in double quotes.
+    with open(path, 'r', newline='') as email_file:
+        return {email.strip(): name.strip()
+                for (name, email) in csv.reader(email_file, skipinitialspace=True)}
+
+
+def _sender_address(display_setting, sender):
+    """Return the From address for the sender_display_name setting.
+
+    The setting has long been the whole From value, such as
+    'Foo Bar <foo@bar.com>', but it can also be just the display name.
+    Either way, we take the display name from it and pair it with the
+    sender's email address.
+    """
+
+    (display_name, address) = parseaddr(display_setting)
+    if '@' not in address:
+        # There's no address in the setting, so it's all display name.
+        display_name = display_setting
+
+    return Address(display_name, addr_spec=sender)
+
+
+class SMTPPool:
+    """Class which holds a set of logged-in connections to an SMTP server.
+
+    Each connection is used by one sender at a time, so a pool of N
+    connections lets N emails be sent at once.  A connection that has
+    sent a lot of messages is replaced with a fresh one, since mail
+    servers commonly limit how many messages they accept per session.
+    If a replacement can't be made, its place in the pool is kept
+    empty (None) until the next sender using it connects again.
+    """
+
+    _MAX_MESSAGES_PER_CONNECTION = 100
+
+    def __init__(self, config, size, debug_level):
+        self._config = config
+        self._debug_level = debug_level
+        self._connections = queue.Queue()
+
+        # Each entry in the queue is a connection and the number of
+        # messages that have been sent over it.  If we can't open them
+        # all, we close the ones we did open.
+        try:
+            for _ in range(size):
+                self._connections.put((self._connect(), 0))
+        except (smtplib.SMTPException, OSError):
+            self.close()
+            raise
+
+    def _connect(self):
+        """Open and log in to a new connection to the mail server."""
+
+        server = smtplib.SMTP(self._config['smtp_server'], self._config['smtp_port'])
+        try:
+            if self._config['tls'] is True:
+                server.starttls()
+            server.login(self._config['account_username'], self._config['account_password'])
+            server.set_debuglevel(self._debug_level)
+        except (smtplib.SMTPException, OSError):
+            server.close()
+            raise
+
+        return server
+
+    @staticmethod
+    def _disconnect(server):
+        """Log out of a connection, or just close it if that fails."""
+
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def send_message(self, message, sender, receiver):
+        """Send a message using whichever connection is free next."""
+
+        (server, sent) = self._connections.get()
+        try:
+            if server is not None and sent >= SMTPPool._MAX_MESSAGES_PER_CONNECTION:
+                SMTPPool._disconnect(server)
+                (server, sent) = (None, 0)
+            if server is None:
+                server = self._connect()
+            server.send_message(message, sender, [receiver])
+            sent += 1
+        finally:
+            self._connections.put((server, sent))
+
+    def close(self):
+        """Log out of and close every connection in the pool.
+
+        A connection which can't be logged out of (because, say, it has
+        already been dropped) is just closed, so that it doesn't keep
+        the others from being closed, or hide the error which broke it.
+        """
+
+        while not self._connections.empty():
+            (server, _) = self._connections.get_nowait()
+            if server is not None:
+                SMTPPool._disconnect(server)
 
 
 class Emailer:
@@ -32,10 +148,9 @@ class Emailer:
             emails = json.loads(self._config['datafile'])
         else:
             try:
-                with open(self._config['datafile'], 'r') as email_file:
-                    for line in email_file:
-                        (name, email) = line.split(',')
-                        emails[email.strip()] = name.strip()
+                # The file rarely changes, so it's only read again when
+                # it does.
+                emails = read_cached(self._config['datafile'], _parse_emails_file)
             except FileNotFoundError as err:
                 print(err)
 
@@ -50,32 +165,46 @@ class Emailer:
         """
 
         emails = self._get_emails()
-
-        # Connect to the mail server
-        server = smtplib.SMTP(self._config['smtp_server'], self._config['smtp_port'])
-        if self._config['tls'] is True:
-            server.starttls()
-        server.login(self._config['account_username'], self._config['account_password'])
+        if len(emails) == 0:
+            return
 
         # If the logging level is set to INFO or below (e.g. DEBUG), we
         # turn on debug messages for the SMTP connection.  Above INFO
         # means that the user wants fewer messages, so we don't turn on
         # debug messages.
         if self._logging_level <= logging.INFO:
-            server.set_debuglevel(1)
+            debug_level = 1
         else:
-            server.set_debuglevel(0)
-
-        # Compose and send the mail
-        sender = self._config['sender_email_address']
-        for (receiver_email, receiver_name) in emails.items():
-            message = 'From: ' + self._config['sender_display_name'] + '\n'
-            message += 'To: ' + receiver_name + ' <' + receiver_email + '>\n'
-            message += 'Subject: ' + subject + '\n\n'
-            message += 'Hi ' + receiver_name + ',\n\n'
-            message += body
-
-            server.sendmail(sender, receiver_email, message)
-        server.quit()
-
-        # TODO:  Received email doesn't have a received time in Outlook (Gmail ok)
+            debug_level = 0
+
+        # Connect to the mail server.  By default we use a single
+        # connection for all of the mail, but the config can ask for
+        # more connections, which are then used to send concurrently.
+        # There's no use in more connections than there are emails.
+        concurrency = min(self._config.get('concurrency', 1), len(emails))
+        pool = SMTPPool(self._config, concurrency, debug_level)
+
+        # Compose and send the mail.  Building each message as an
+        # EmailMessage gives it proper MIME, Date, and Message-ID headers,
+        # and lets smtplib take care of encoding it.
+        try:
+            sender = self._config['sender_email_address']
+            sender_address = _sender_address(self._config['sender_display_name'], sender)
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = []
+                for (receiver_email, receiver_name) in emails.items():
+                    message = EmailMessage()
+                    message['From'] = sender_address
+                    message['To'] = Address(receiver_name, addr_spec=receiver_email)
+                    message['Subject'] = subject
+                    message['Date'] = formatdate(localtime=True)
+                    message['Message-ID'] = make_msgid()
+                    message.set_content('Hi ' + receiver_name + ',\n\n' + body)
+
+                    futures.append(executor.submit(pool.send_message, message, sender,
+                                                   receiver_email))
+
+                for future in futures:
+                    future.result()
+        finally:
+            pool.close()
@@ -0,0 +1,10 @@
+"""Provide the fastest JSON parser that's installed."""
+
+# orjson parses JSON several times faster than the standard library, so
+# we use it when it's installed.  Before Python 3.6 the standard
+# library's loads() only accepts text, not bytes, so we always give it
+# text.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
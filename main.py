@@ -10,31 +10,37 @@ import getopt
 import json
 import logging
 import os
+import socket
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import charge_status
+from cached_file import read_cached
 from send_sms import MessageSender
 from emailer import Emailer
+from fast_json import json_loads
 
 
+# Logging levels by the (lowercase) names we accept for them.
+_LEVELS = {
+    'debug' : logging.DEBUG,
+    'info' : logging.INFO,
+    'warning' : logging.WARNING,
+    'error' : logging.ERROR,
+    'critical' : logging.CRITICAL
+}
+
 def map_logging_level_string(level_string):
     """Convert string to its equivalent logging level."""
 
-    if str.lower(level_string) == 'debug':
-        logging_level = logging.DEBUG
-    elif str.lower(level_string) == 'info':
-        logging_level = logging.INFO
-    elif str.lower(level_string) == 'warning':
-        logging_level = logging.WARNING
-    elif str.lower(level_string) == 'error':
-        logging_level = logging.ERROR
-    elif str.lower(level_string) == 'critical':
-        logging_level = logging.CRITICAL
-    else:
-        # Our default logging level is warning and above.
-        logging_level = logging.WARNING
+    # Our default logging level is warning and above.
+    return _LEVELS.get(level_string.lower(), logging.WARNING)
 
-    return logging_level
+def _parse_configuration_file(path):
+    """Read and parse a JSON configuration file."""
+
+    with open(path, 'r', encoding='utf-8') as config_file:
+        return json_loads(config_file.read())
 
 def load_configuration_file():
     """Load our configuration from permanent storage.
@@ -45,11 +51,17 @@ def load_configuration_file():
     but some configuration values can only be set in the JSON file, so
     we require it to exist and will terminate with an exception if it
     does not.
+
+    The exception to this is when the whole configuration is passed in
+    the TESLAALERT_CONFIG_JSON environment variable (handy for container
+    deployments), in which case we use that and don't touch the file.
     """
 
-    config_file = open('config.json', 'r')
-    config = json.load(config_file)
-    config_file.close()
+    config_json = os.environ.get('TESLAALERT_CONFIG_JSON')
+    if config_json is not None:
+        config = json_loads(config_json)
+    else:
+        config = read_cached('config.json', _parse_configuration_file)
 
     # The logging level set in the JSON file is a simple string, and
     # needs to be converted to a number (an enum, in effect) which can
@@ -58,60 +70,82 @@ def load_configuration_file():
 
     return config
 
-def process_environment_vars(config):
-    """Process environment variables, return results.
+def _parse_bool(value):
+    """Convert an environment variable's string to a boolean.
 
-    We're given an existing set of configuration settings, and any
-    environment variables that we process replace those in the existing
-    set.
+    Besides 1 and 0, we accept the usual words for true and false (in
+    any case); anything that isn't one of the words for true is false.
     """
 
+    return value.lower() in {'1', 'true', 'yes', 'on'}
+
+def _set_nested(config, path, value):
+    """Set a value in the configuration, given the path of keys to it."""
+
+    for key in path[:-1]:
+        config = config[key]
+    config[path[-1]] = value
+
+# Environment variables we process, each with the path of keys to the
+# setting it replaces and the function which converts it to that
+# setting's type.
+_ENV_MAP = [
     # Environment variables for the Tesla REST API.
-    tesla_config = config['tesla_connect']
-    if 'TESLAALERT_USERNAME' in os.environ:
-        tesla_config['username'] = os.environ['TESLAALERT_USERNAME']
-    if 'TESLAALERT_PASSWORD' in os.environ:
-        tesla_config['password'] = os.environ['TESLAALERT_PASSWORD']
-    if 'TESLAALERT_HOME_LATITUDE' in os.environ:
-        tesla_config['home_location']['latitude'] = float(os.environ['TESLAALERT_HOME_LATITUDE'])
-    if 'TESLAALERT_HOME_LONGITUDE' in os.environ:
-        tesla_config['home_location']['longitude'] = float(os.environ['TESLAALERT_HOME_LONGITUDE'])
+    ('TESLAALERT_USERNAME', ('tesla_connect', 'username'), str),
+    ('TESLAALERT_PASSWORD', ('tesla_connect', 'password'), str),
+    ('TESLAALERT_HOME_LATITUDE', ('tesla_connect', 'home_location', 'latitude'), float),
+    ('TESLAALERT_HOME_LONGITUDE', ('tesla_connect', 'home_location', 'longitude'), float),
+    ('TESLAALERT_TOKEN_CACHE', ('tesla_connect', 'token_cache'), str),
 
     # Environment variables for the Twilio REST API.
-    twilio_config = config['twilio']
-    if 'TESLAALERT_TWILIO_DATAFILE' in os.environ:
-        twilio_config['datafile'] = os.environ['TESLAALERT_TWILIO_DATAFILE']
-    if 'TESLAALERT_TWILIO_ACCOUNT_SID' in os.environ:
-        twilio_config['account_sid'] = os.environ['TESLAALERT_TWILIO_ACCOUNT_SID']
-    if 'TESLAALERT_TWILIO_AUTH_TOKEN' in os.environ:
-        twilio_config['auth_token'] = os.environ['TESLAALERT_TWILIO_AUTH_TOKEN']
-    if 'TESLAALERT_TWILIO_SENDING_NUMBER' in os.environ:
-        twilio_config['sending_number'] = os.environ['TESLAALERT_TWILIO_SENDING_NUMBER']
+    ('TESLAALERT_TWILIO_DATAFILE', ('twilio', 'datafile'), str),
+    ('TESLAALERT_TWILIO_ACCOUNT_SID', ('twilio', 'account_sid'), str),
+    ('TESLAALERT_TWILIO_AUTH_TOKEN', ('twilio', 'auth_token'), str),
+    ('TESLAALERT_TWILIO_SENDING_NUMBER', ('twilio', 'sending_number'), str),
 
     # Environment variables for the SMTP server we're using.
-    smtp_config = config['smtp']
-    if 'TESLAALERT_SMTP_DATAFILE' in os.environ:
-        smtp_config['datafile'] = os.environ['TESLAALERT_SMTP_DATAFILE']
-    if 'TESLAALERT_SMTP_SERVER' in os.environ:
-        smtp_config['smtp_server'] = os.environ['TESLAALERT_SMTP_SERVER']
-    if 'TESLAALERT_SMTP_PORT' in os.environ:
-        smtp_config['smtp_port'] = int(os.environ['TESLAALERT_SMTP_PORT'])
-    if 'TESLAALERT_SMTP_USERNAME' in os.environ:
-        smtp_config['account_username'] = os.environ['TESLAALERT_SMTP_USERNAME']
-    if 'TESLAALERT_SMTP_PASSWORD' in os.environ:
-        smtp_config['account_password'] = os.environ['TESLAALERT_SMTP_PASSWORD']
-    if 'TESLAALERT_SMTP_USE_TLS' in os.environ:
-        smtp_config['tls'] = bool(int(os.environ['TESLAALERT_SMTP_USE_TLS']))
-    if 'TESLAALERT_SMTP_SENDER_EMAIL' in os.environ:
-        smtp_config['sender_email_address'] = os.environ['TESLAALERT_SMTP_SENDER_EMAIL']
-    if 'TESLAALERT_SMTP_SENDER_DISPLAY' in os.environ:
-        smtp_config['sender_display_name'] = os.environ['TESLAALERT_SMTP_SENDER_DISPLAY']
+    ('TESLAALERT_SMTP_DATAFILE', ('smtp', 'datafile'), str),
+    ('TESLAALERT_SMTP_SERVER', ('smtp', 'smtp_server'), str),
+    ('TESLAALERT_SMTP_PORT', ('smtp', 'smtp_port'), int),
+    ('TESLAALERT_SMTP_USERNAME', ('smtp', 'account_username'), str),
+    ('TESLAALERT_SMTP_PASSWORD', ('smtp', 'account_password'), str),
+    ('TESLAALERT_SMTP_USE_TLS', ('smtp', 'tls'), _parse_bool),
+    ('TESLAALERT_SMTP_SENDER_EMAIL', ('smtp', 'sender_email_address'), str),
+    ('TESLAALERT_SMTP_SENDER_DISPLAY', ('smtp', 'sender_display_name'), str),
 
     # "Free-floating" environment variables.
-    if 'TESLAALERT_SEND_EMAIL' in os.environ:
-        config['send_email'] = bool(int(os.environ['TESLAALERT_SEND_EMAIL']))
-    if 'TESLAALERT_LOGGING_LEVEL' in os.environ:
-        config['logging_level'] = os.environ['TESLAALERT_LOGGING_LEVEL']
+    ('TESLAALERT_SEND_EMAIL', ('send_email',), _parse_bool),
+    ('TESLAALERT_LOGGING_LEVEL', ('logging_level',), map_logging_level_string)
+]
+
+# Command-line options we process (other than help), each with the path
+# of keys to the setting it replaces and the function which converts its
+# argument to that setting's type.
+_OPTION_MAP = {
+    '-u' : (('tesla_connect', 'username'), str),
+    '--username' : (('tesla_connect', 'username'), str),
+    '-p' : (('tesla_connect', 'password'), str),
+    '--password' : (('tesla_connect', 'password'), str),
+    '--latitude' : (('tesla_connect', 'home_location', 'latitude'), float),
+    '--longitude' : (('tesla_connect', 'home_location', 'longitude'), float),
+    '-e' : (('send_email',), lambda _: True),
+    '--email' : (('send_email',), lambda _: True),
+    '-l' : (('logging_level',), map_logging_level_string),
+    '--loglevel' : (('logging_level',), map_logging_level_string)
+}
+
+def process_environment_vars(config):
+    """Process environment variables, return results.
+
+    We're given an existing set of configuration settings, and any
+    environment variables that we process replace those in the existing
+    set.
+    """
+
+    for (env_name, path, cast) in _ENV_MAP:
+        value = os.environ.get(env_name)
+        if value is not None:
+            _set_nested(config, path, cast(value))
 
     return config
 
@@ -152,21 +186,35 @@ def process_command_line(config, argv):
         if opt in ('-h', '--help'):
             usage(argv[0])
             sys.exit()
-        elif opt in ('-u', '--username'):
-            config['tesla_connect']['username'] = arg
-        elif opt in ('-p', '--password'):
-            config['tesla_connect']['password'] = arg
-        elif opt in ('--latitude',):
-            config['tesla_connect']['home_location']['latitude'] = float(arg)
-        elif opt in ('--longitude',):
-            config['tesla_connect']['home_location']['longitude'] = float(arg)
-        elif opt in ('-e', '--email'):
-            config['send_email'] = True
-        elif opt in ('-l', '--loglevel'):
-            config['logging_level'] = map_logging_level_string(arg)
+
+        (path, cast) = _OPTION_MAP[opt]
+        _set_nested(config, path, cast(arg))
 
     return config
 
+def _resolve_host(host, port):
+    """Look up a host's address, warming the resolver's cache for it."""
+
+    try:
+        socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except OSError as err:
+        # The real connection attempt will report the problem.
+        logging.getLogger(__name__).debug("Couldn't resolve %s: %s", host, err)
+
+def warm_up(config, executor):
+    """Start the name lookups for the services we send alerts through.
+
+    We only connect to Twilio and the SMTP server once we know there's an
+    alert to send, which is after we've heard back from the Tesla
+    servers.  Looking up their addresses while we wait on Tesla means
+    that, where lookups are cached (as they are by most resolvers), the
+    lookups are out of the way by the time we send alerts.
+    """
+
+    executor.submit(_resolve_host, 'api.twilio.com', 443)
+    if config['send_email'] is True:
+        executor.submit(_resolve_host, config['smtp']['smtp_server'], config['smtp']['smtp_port'])
+
 def main(argv):
     """Top-level function."""
 
@@ -183,22 +231,34 @@ def main(argv):
     config = process_command_line(config, argv)
 
     logging.basicConfig(level=config['logging_level'])
-    logging.getLogger(__name__).debug("Final config after all processing:\n%s",
-                                      json.dumps(config, indent=4))
+    logger = logging.getLogger(__name__)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Final config after all processing:\n%s", json.dumps(config, indent=4))
 
     # Do the main work of the program:  for every unplugged vehicle in
     # the home location, compose a message for the user.  Send the message
-    # using text messages and optionally emails as well.
+    # using text messages and optionally emails as well.  Sending the text
+    # messages and sending the emails don't depend on each other, so we
+    # do both at the same time.
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        warm_up(config, executor)
+        unplugged_vehicles = charge_status.check_plugin_status_all(config)
 
-    unplugged_vehicles = charge_status.check_plugin_status_all(config)
     if len(unplugged_vehicles) > 0:
         message = charge_status.compose_disconnect_message(unplugged_vehicles)
         print(message)
-        sms_sender = MessageSender(config)
-        sms_sender.send_sms('Alert:  Tesla charge status', message)
-        if config['send_email'] is True:
-            emailer = Emailer(config)
-            emailer.send_emails('Alert:  Tesla charge status', message)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            sms_sender = MessageSender(config)
+            futures = [executor.submit(sms_sender.send_sms, 'Alert:  Tesla charge status',
+                                       message)]
+            if config['send_email'] is True:
+                emailer = Emailer(config)
+                futures.append(executor.submit(emailer.send_emails,
+                                               'Alert:  Tesla charge status', message))
+
+            for future in futures:
+                future.result()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,24 @@
 """Provide SMS notification support."""
 
+import csv
 import logging
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from twilio.rest import TwilioRestClient
 
+from cached_file import read_cached
+
+
+def _parse_numbers_file(path):
+    """Read a file of names and phone numbers into a dictionary."""
+
+    # Each line is a name and phone number separated by a comma.  A
+    # name which itself contains a comma can be given in double quotes.
+    with open(path, 'r', newline='') as numbers_file:
+        return {number.strip(): name.strip()
+                for (name, number) in csv.reader(numbers_file, skipinitialspace=True)}
+
 
 class MessageSender:
     """Class which handles sending notification text messages."""
@@ -33,10 +47,9 @@ class MessageSender:
             phone_numbers = json.loads(self._config['datafile'])
         else:
             try:
-                with open(self._config['datafile'], 'r') as numbers_file:
-                    for line in numbers_file:
-                        (name, number) = line.split(',')
-                        phone_numbers[number.strip()] = name.strip()
+                # The file rarely changes, so it's only read again when
+                # it does.
+                phone_numbers = read_cached(self._config['datafile'], _parse_numbers_file)
             except FileNotFoundError as err:
                 print(err)
 
@@ -53,12 +66,30 @@ class MessageSender:
 
         # Get the phone numbers dictionary.
         phone_numbers = self._get_phone_numbers()
+        if len(phone_numbers) == 0:
+            return
 
         # Create the Twilio REST client, which we'll use for sending each SMS.
         client = TwilioRestClient(self._config['account_sid'], self._config['auth_token'])
 
-        # Compose and send each SMS.
-        for (number, name) in phone_numbers.items():
+        def _send_one(number, name):
+            """Compose and send a single SMS."""
+
             self._logger.info("Sending SMS to %s (%s).", name, number)
             message = subject + '. Hi ' + name + ', ' + body
             client.messages.create(to=number, from_=self._config['sending_number'], body=message)
+
+        # Each SMS is a separate request to Twilio, so we send them
+        # concurrently.  A failure to reach one recipient shouldn't stop
+        # the others from being notified, so failures are logged rather
+        # than raised.
+        with ThreadPoolExecutor(max_workers=min(10, len(phone_numbers))) as executor:
+            futures = {}
+            for (number, name) in phone_numbers.items():
+                futures[executor.submit(_send_one, number, name)] = number
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    self._logger.exception("Failed to send SMS to %s.", futures[future])
@@ -2,16 +2,28 @@
 
 import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from fast_json import json_loads
 
 
 class TeslaConnect:
     """Class which encapsulates all usage of the Telsa REST API."""
 
-    # API endpoints
+    # API endpoints.  The per-vehicle URLs are templates which take the
+    # vehicle ID.
     _portal = 'https://owner-api.teslamotors.com/api/1/vehicles/'
     _owner_api = 'https://owner-api.teslamotors.com'
+    _token_url = _owner_api + '/oauth/token'
+    _mobile_enabled_url = _portal + '{}/mobile_enabled'
+    _vehicle_data_url = _portal + '{}/vehicle_data?endpoints=charge_state%3Bdrive_state'
 
     # User agent which emulates the Android mobile app
     _version = '2.1.79'
@@ -19,19 +31,90 @@ class TeslaConnect:
     _codename = 'REL'
     _release = '4.4.4'
     _locale = 'en_US'
-    _user_agent = ('Model S ' + _version + ' (' + _model + '; Android ' + _codename + ' '
-                   + _release + '; ' + _locale + ')')
+    _user_agent = 'Model S {} ({}; Android {} {}; {})'.format(_version, _model, _codename,
+                                                              _release, _locale)
+
+    # HTTP headers sent with every API call, other than the token.
+    _common_headers = {
+        'Content-Type' : 'application/json; charset=utf-8',
+        'User-Agent' : _user_agent
+    }
+
+    # A cached authentication token is only reused if it's valid for at
+    # least this many more seconds.
+    _min_token_lifetime = 3600
 
     def __init__(self, config):
         self._config = config
         self._logger = logging.getLogger(__name__)
 
+        # Vehicle data we've already fetched, keyed by vehicle ID.
+        self._snapshots = {}
+
+        # All of our requests go to the same host, so we make them through
+        # a single session, which keeps connections open between requests
+        # instead of doing a new TLS handshake for every one of them.  The
+        # pool is sized for the concurrent per-vehicle requests, and
+        # transient server errors are retried with a short backoff.
+        self._session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                                    max_retries=retries))
+
         # First, we get the authentication token, which is needed for
-        # all subsequent API calls.  Once we get it, we can set it as
-        # part of the common HTTP headers.
+        # all subsequent API calls.  Tokens are valid for weeks, so if
+        # the config names a token cache file, we reuse the token saved
+        # there by an earlier run rather than logging in again.  Once we
+        # have a token, we can set it as part of the common HTTP headers.
+
+        self._token_lock = threading.Lock()
+        self._token = self._load_cached_token()
+        if self._token is None:
+            self._token = self._request_token()
+
+        self._http_headers = dict(TeslaConnect._common_headers)
+        self._http_headers['Authorization'] = 'Bearer ' + self._token
+        self._session.headers.update(self._http_headers)
+
+    def _token_cache_path(self):
+        """Return the path of the token cache file, or None if there isn't one."""
+
+        if self._config.get('token_cache') is None:
+            return None
+
+        return os.path.expanduser(self._config['token_cache'])
+
+    def _load_cached_token(self):
+        """Return the token saved by an earlier run, if it's still good.
+
+        The token is only reused if it was saved for the account we're
+        logging in to, so changing the username gets a new token.
+        """
+
+        token_cache_path = self._token_cache_path()
+        if token_cache_path is None:
+            return None
+
+        try:
+            with open(token_cache_path, 'r', encoding='utf-8') as token_file:
+                cached = json_loads(token_file.read())
+            if cached['username'] != self._config['username']:
+                self._logger.info("Not using cached token: it's for another account.")
+            elif cached['expires_at'] - time.time() > TeslaConnect._min_token_lifetime:
+                return cached['access_token']
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self._logger.info("Not using cached token: %s", err)
+
+        return None
+
+    def _request_token(self):
+        """Log in to the Tesla servers and return a new token.
+
+        If there is a token cache file, the new token is saved in it.  We
+        write the file under a temporary name and then rename it, so a
+        reader never sees a partly-written file.
+        """
 
-        self._token = ''
-        token_url = TeslaConnect._owner_api + '/oauth/token'
         payload = {
             'grant_type' : 'password',
             'client_id' : 'e4a9949fcfa04068f59abb5a658f2bac0a3428e4652315490b659d5ab3f35a9e',
@@ -39,17 +122,59 @@ class TeslaConnect:
         }
         payload['email'] = self._config['username']
         payload['password'] = self._config['password']
-        response = requests.post(token_url, data=payload)
 
-        authdata = response.json()
-        self._token = authdata['access_token']
+        # This is a form post, so it mustn't carry the JSON content type
+        # or the old token from the session's common headers.
+        response = self._session.post(TeslaConnect._token_url, data=payload,
+                                      headers={'Authorization' : None, 'Content-Type' : None})
 
-        self._http_headers = {}
-        self._http_headers['Authorization'] = 'Bearer ' + self._token
-        self._http_headers['Content-Type'] = 'application/json; charset=utf-8'
-        self._http_headers['User-Agent'] = self._user_agent
+        authdata = json_loads(response.text)
+
+        token_cache_path = self._token_cache_path()
+        if token_cache_path is not None and 'expires_in' in authdata:
+            cached = {
+                'username' : self._config['username'],
+                'access_token' : authdata['access_token'],
+                'expires_at' : time.time() + authdata['expires_in']
+            }
+            try:
+                # A bare file name goes in the current directory, which
+                # is already there.
+                token_cache_dir = os.path.dirname(token_cache_path)
+                if token_cache_dir:
+                    os.makedirs(token_cache_dir, exist_ok=True)
+                temp_path = token_cache_path + '.tmp'
+                temp_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(temp_fd, 'w') as token_file:
+                    json.dump(cached, token_file)
+                os.replace(temp_path, token_cache_path)
+            except OSError as err:
+                self._logger.warning("Couldn't save token to %s: %s", token_cache_path, err)
 
-    def get_vehicles(self):
+        return authdata['access_token']
+
+    def _get(self, url):
+        """Make a GET request, logging in again if our token is rejected.
+
+        A token we got from the cache may have been revoked since it was
+        saved, in which case the server answers 401.  We then get a new
+        token (once, even when several threads see the 401) and retry.
+        """
+
+        token = self._token
+        response = self._session.get(url)
+        if response.status_code == 401:
+            with self._token_lock:
+                if self._token == token:
+                    self._logger.info("Token rejected, logging in again.")
+                    self._token = self._request_token()
+                    self._http_headers['Authorization'] = 'Bearer ' + self._token
+                    self._session.headers.update(self._http_headers)
+            response = self._session.get(url)
+
+        return response
+
+    def get_vehicles(self, check_mobile_enabled=True):
         """Return a list of all the vehicles in the user's account.
 
         Construct a dictionary (key = vehicle ID, value = vehicle name)
@@ -59,51 +184,103 @@ class TeslaConnect:
         don't include cars which are marked as being "in service", because
         those cars may also not be accessible, and because we're likely
         not dealing with charging them, anyway.
+
+        The mobile-enabled check is a separate request for each car, so
+        those requests are made concurrently.  Callers that are about to
+        get each car's vehicle data anyway can skip the check, and rely on
+        get_vehicle_snapshot() failing for cars that aren't mobile-enabled.
         """
 
-        vehicles_url = TeslaConnect._portal
-        response = requests.get(vehicles_url, headers=self._http_headers)
-        vehicles_json = response.json()
-        self._logger.info("Vehicle list:\n%s", json.dumps(vehicles_json, indent=4))
+        response = self._get(TeslaConnect._portal)
+        # We parse the body once, and log it as it came back from the
+        # server rather than reformatting the parsed JSON.
+        vehicles_text = response.text
+        self._logger.info("Vehicle list:\n%s", vehicles_text)
+        vehicles_json = json_loads(vehicles_text)
 
         vehicles = {}
         if vehicles_json['count'] > 0:
-            for vehicle in vehicles_json['response']:
-                if (len(vehicle['id_s']) > 0) and (not vehicle['in_service']):
-                    mobile_enabled_url = (TeslaConnect._portal
-                                          + vehicle['id_s'] + '/mobile_enabled')
-                    response = requests.get(mobile_enabled_url, headers=self._http_headers)
-                    mobile_enabled_json = response.json()
-
-                    if mobile_enabled_json['response'] is True:
-                        vehicles[vehicle['id_s']] = vehicle['display_name']
+            candidates = [vehicle for vehicle in vehicles_json['response']
+                          if (len(vehicle['id_s']) > 0) and (not vehicle['in_service'])]
+            if not check_mobile_enabled:
+                for vehicle in candidates:
+                    vehicles[vehicle['id_s']] = vehicle['display_name']
+            elif len(candidates) > 0:
+                with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+                    mobile_enabled = executor.map(self._is_mobile_enabled,
+                                                  [vehicle['id_s'] for vehicle in candidates])
+                    for (vehicle, enabled) in zip(candidates, mobile_enabled):
+                        if enabled is True:
+                            vehicles[vehicle['id_s']] = vehicle['display_name']
 
         return vehicles
 
+    def _is_mobile_enabled(self, vehicle_id):
+        """Check if the passed-in car can be queried with the car-access APIs."""
+
+        response = self._get(TeslaConnect._mobile_enabled_url.format(vehicle_id))
+        mobile_enabled_json = json_loads(response.text)
+
+        return mobile_enabled_json['response'] is True
+
+    def get_vehicle_snapshot(self, vehicle_id):
+        """Return the drive and charge state of the passed-in car.
+
+        Both pieces of state come back from a single request to the
+        vehicle_data endpoint, rather than one request each to the
+        drive_state and charge_state endpoints.  The result is kept, so
+        later calls for the same car don't go back to the Tesla servers.
+
+        If the car's data can't be had (because, for example, the car
+        isn't mobile-enabled or is asleep, or the Tesla servers kept
+        failing the request after all of our retries), we return None.
+        """
+
+        if vehicle_id not in self._snapshots:
+            try:
+                response = self._get(TeslaConnect._vehicle_data_url.format(vehicle_id))
+            except requests.RequestException as err:
+                self._logger.warning("Couldn't get vehicle data for vehicle %s: %s",
+                                     vehicle_id, err)
+                self._snapshots[vehicle_id] = None
+                return None
+
+            if response.status_code != 200:
+                self._logger.warning("Couldn't get vehicle data for vehicle %s (status %d).",
+                                     vehicle_id, response.status_code)
+                self._snapshots[vehicle_id] = None
+                return None
+
+            vehicle_data_text = response.text
+            self._logger.info("Vehicle data for vehicle %s:\n%s", vehicle_id, vehicle_data_text)
+            vehicle_data_json = json_loads(vehicle_data_text)
+
+            self._snapshots[vehicle_id] = vehicle_data_json['response']
+
+        return self._snapshots[vehicle_id]
+
     def is_car_at_home(self, vehicle_id):
         """Check if the passed-in car is at the home location."""
 
-        drive_state_url = (TeslaConnect._portal + vehicle_id + '/data_request/drive_state')
-        response = requests.get(drive_state_url, headers=self._http_headers)
-        drive_state_json = response.json()
-        self._logger.info("Drive state info for vehicle %s:\n%s", vehicle_id,
-                          json.dumps(drive_state_json, indent=4))
+        snapshot = self.get_vehicle_snapshot(vehicle_id)
+        if snapshot is None:
+            return False
+
+        drive_state = snapshot['drive_state']
 
         # We use a fairly loose comparison of latitude and longitude which puts
         # us within a couple hundred feet of the home location.
-        return bool(abs(drive_state_json['response']['latitude']
+        return bool(abs(drive_state['latitude']
                         - self._config['home_location']['latitude']) <= 0.0005
-                    and abs(drive_state_json['response']['longitude']
+                    and abs(drive_state['longitude']
                             - self._config['home_location']['longitude']) <= 0.0005)
 
     def is_car_unplugged(self, vehicle_id):
         """Check if the passed-in car is unplugged or not."""
 
-        charge_status_url = (TeslaConnect._portal + vehicle_id + '/data_request/charge_state')
-        response = requests.get(charge_status_url, headers=self._http_headers)
-        charge_state_json = response.json()
-        self._logger.info("Charge state info for vehicle %s:\n%s", vehicle_id,
-                          json.dumps(charge_state_json, indent=4))
+        snapshot = self.get_vehicle_snapshot(vehicle_id)
+        if snapshot is None:
+            return False
 
-        charging_state = charge_state_json['response']['charging_state']
+        charging_state = snapshot['charge_state']['charging_state']
         return bool(charging_state == 'Disconnected')
@@ -0,0 +1,113 @@
+"""Test suite for the charge_status module"""
+
+import json
+import unittest
+from unittest.mock import patch, DEFAULT, Mock
+
+import requests
+
+import charge_status
+from tesla_connect import TeslaConnect
+
+
+class ChargeStatusTestCase(unittest.TestCase):
+    """Unit tests for the charge_status module"""
+
+    _mock_config = {
+        'tesla_connect' : {
+            'username' : 'me@myplace.com',
+            'password' : 'pAssw0rd',
+            'home_location' : {
+                'latitude' : 28.50,
+                'longitude' : -101.01
+            }
+        }
+    }
+
+    @patch('charge_status.TeslaConnect')
+    def test_multiple_unplugged_vehicles(self, mock_tesla_connect):
+        """Reports every car that is at home and unplugged.
+
+        When more than one car in the user's account is at home and
+        unplugged, we want to make sure that all of them are returned,
+        and that cars which are away or plugged in are not.  Cars which
+        are away shouldn't be checked for being unplugged at all.
+        """
+
+        mock_instance = mock_tesla_connect.return_value
+        mock_instance.get_vehicles.return_value = {
+            '111' : 'foo',
+            '222' : 'bar',
+            '333' : 'baz',
+            '444' : 'qux'
+        }
+        mock_instance.is_car_at_home.side_effect = lambda vehicle_id: vehicle_id != '333'
+        mock_instance.is_car_unplugged.side_effect = lambda vehicle_id: vehicle_id != '444'
+
+        unplugged_vehicles = charge_status.check_plugin_status_all(self._mock_config)
+
+        self.assertEqual(unplugged_vehicles, {'111' : 'foo', '222' : 'bar'})
+
+        # The cars are checked from several threads at once, and a mock's
+        # call_count can lose calls made at the same time, so we check
+        # which cars the calls it recorded were for instead.
+        checked_ids = {call[0][0] for call in mock_instance.is_car_unplugged.call_args_list}
+        self.assertEqual(checked_ids, {'111', '222', '444'})
+
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_vehicle_data_request_fails(self, post, get):
+        """Skips a car whose vehicle data request fails, and reports the rest.
+
+        When the Tesla servers keep answering the request for one car's
+        data with a 503, requests gives up after its retries and raises
+        a RetryError.  We want that car skipped, and the other unplugged
+        cars at home still reported.
+        """
+
+        def response(payload):
+            return Mock(status_code=200, text=json.dumps(payload))
+
+        vehicle_data = {
+            'response' : {
+                'drive_state' : {'latitude' : 28.50, 'longitude' : -101.01},
+                'charge_state' : {'charging_state' : 'Disconnected'}
+            }
+        }
+        responses = {
+            TeslaConnect._portal : response({
+                'count' : 3,
+                'response' : [
+                    {'id_s' : '111', 'display_name' : 'foo', 'in_service' : False},
+                    {'id_s' : '222', 'display_name' : 'bar', 'in_service' : False},
+                    {'id_s' : '333', 'display_name' : 'baz', 'in_service' : False}
+                ]
+            }),
+            TeslaConnect._vehicle_data_url.format('111') : response(vehicle_data),
+            TeslaConnect._vehicle_data_url.format('333') : response(vehicle_data)
+        }
+
+        def get_response(url, **kwargs):
+            if url == TeslaConnect._vehicle_data_url.format('222'):
+                raise requests.exceptions.RetryError('Max retries exceeded (too many 503s)')
+            return responses[url]
+
+        post.return_value = response({'access_token' : 'foo'})
+        get.side_effect = get_response
+
+        unplugged_vehicles = charge_status.check_plugin_status_all(self._mock_config)
+
+        self.assertEqual(unplugged_vehicles, {'111' : 'foo', '333' : 'baz'})
+
+    def test_compose_disconnect_message(self):
+        """Composes one line per disconnected car."""
+
+        message = charge_status.compose_disconnect_message({'111' : 'foo', '222' : 'bar'})
+
+        # The order of the cars in the dictionary isn't fixed (before
+        # Python 3.6), so neither is the order of the lines.
+        self.assertEqual(sorted(message.split('\n')),
+                         ['Vehicle bar is disconnected.', 'Vehicle foo is disconnected.'])
+
+
+if __name__ == '__main__':
+    unittest.main()
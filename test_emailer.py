@@ -1,30 +1,44 @@
 """Test suite for the Emailer class"""
 
-import copy
 import logging
 import os
+import shutil
+import smtplib
+import tempfile
+import types
 import unittest
 from unittest.mock import patch, MagicMock
 
-from emailer import Emailer
+from emailer import Emailer, SMTPPool
 
 
 class EmailerTestCase(unittest.TestCase):
     """Unit tests for the Emailer class"""
 
-    _TEST_FILE = 'test_emails.txt'
+    @classmethod
+    def setUpClass(cls):
+        # The emails files don't change from test to test, so we write
+        # them once, into a temporary directory, for the whole class.
+        cls._test_dir = tempfile.mkdtemp()
 
-    def setUp(self):
-        pass
+        cls._single_path = os.path.join(cls._test_dir, 'single.txt')
+        with open(cls._single_path, 'w') as emails_file:
+            emails_file.write('First Recipient, first.recipient@whatever.com')
+
+        cls._multi_path = os.path.join(cls._test_dir, 'multi.txt')
+        with open(cls._multi_path, 'w') as emails_file:
+            emails_file.write('First Recipient, first.recipient@whatever.com\n')
+            emails_file.write('Second Recipient, second.recipient@whatever.com\n')
+            emails_file.write('Third Recipient, third.recipient@whatever.com')
 
-    def tearDown(self):
-        try:
-            os.remove(self._TEST_FILE)
-        except FileNotFoundError:
-            pass
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._test_dir)
 
-    _mock_config = {
-        'smtp': {
+    # The base config structure is shared by all of the tests, so it's
+    # read-only, and tests which need different settings make their own.
+    _mock_config = types.MappingProxyType({
+        'smtp': types.MappingProxyType({
             'datafile': 'test_emails.txt',
             'smtp_server': 'smtp.fakeserver.com',
             'smtp_port': 587,
@@ -33,9 +47,20 @@ class EmailerTestCase(unittest.TestCase):
             'account_password': 'badpassword',
             'sender_email_address': 'foo@fakeserver.com',
             'sender_display_name': 'Foo Bar <foo@fakeserver.com>'
-        },
+        }),
         'logging_level' : logging.DEBUG
-    }
+    })
+
+    def _config_with(self, **smtp_settings):
+        """Return a copy of the mock config with some SMTP settings replaced.
+
+        Only the dictionaries on the way to the replaced settings are
+        copied, as the base config structure itself is read-only.
+        """
+
+        config = dict(self._mock_config)
+        config['smtp'] = dict(self._mock_config['smtp'], **smtp_settings)
+        return config
 
     @patch('emailer.smtplib.SMTP')
     def test_send_one_email(self, mock_smtp):
@@ -46,23 +71,44 @@ class EmailerTestCase(unittest.TestCase):
         service is made to send the email.
         """
 
-        # Create an emails file with a single entry.
-        with open(self._TEST_FILE, 'w') as emails_file:
-            emails_file.write('First Recipient, first.recipient@whatever.com')
-
         # Create a mock object for the SMTP server that the Emailer
         # module uses (the return value from a call to smtplib.SMTP).
         mock_server = MagicMock()
         mock_smtp.return_value = mock_server
 
-        # Use our email sending class to send a fake email.
-        emailer = Emailer(self._mock_config)
+        # Use our email sending class to send a fake email to the
+        # recipient in the single-entry emails file.
+        emailer = Emailer(self._config_with(datafile=self._single_path))
         emailer.send_emails('Fake subject', 'Fake message')
 
         self.assertTrue(mock_smtp.called)
         self.assertTrue(mock_server.login.called)
         self.assertTrue(mock_server.starttls.called)
-        self.assertTrue(mock_server.sendmail.call_count == 1)
+        self.assertTrue(mock_server.send_message.call_count == 1)
+
+        (message, _, _) = mock_server.send_message.call_args[0]
+        self.assertEqual(message['From'], 'Foo Bar <foo@fakeserver.com>')
+
+    @patch('emailer.smtplib.SMTP')
+    def test_sender_display_name_only(self, mock_smtp):
+        """Sends from the display name and the sender's address.
+
+        When the sender display name setting is only a name, without an
+        address, we verify that the email comes from that name at the
+        sender's email address.
+        """
+
+        # Create a mock object for the SMTP server that the Emailer
+        # module uses (the return value from a call to smtplib.SMTP).
+        mock_server = MagicMock()
+        mock_smtp.return_value = mock_server
+
+        emailer = Emailer(self._config_with(datafile=self._single_path,
+                                            sender_display_name='Foo Bar'))
+        emailer.send_emails('Fake subject', 'Fake message')
+
+        (message, _, _) = mock_server.send_message.call_args[0]
+        self.assertEqual(message['From'], 'Foo Bar <foo@fakeserver.com>')
 
     @patch('emailer.smtplib.SMTP')
     def test_send_multiple_emails(self, mock_smtp):
@@ -73,24 +119,206 @@ class EmailerTestCase(unittest.TestCase):
         is made once per recipient.
         """
 
-        # Create a emails file with a multiple entries.
-        with open(self._TEST_FILE, 'w') as numbers_file:
-            numbers_file.write('First Recipient, first.recipient@whatever.com\n')
-            numbers_file.write('Second Recipient, second.recipient@whatever.com\n')
-            numbers_file.write('Third Recipient, third.recipient@whatever.com')
-
         # Create a mock object for the SMTP server that the Emailer
         # module uses (the return value from a call to smtplib.SMTP).
         mock_server = MagicMock()
         mock_smtp.return_value = mock_server
 
-        # Use our email sending class to send a fake email.
-        emailer = Emailer(self._mock_config)
+        # Use our email sending class to send a fake email to the
+        # recipients in the multiple-entry emails file.
+        emailer = Emailer(self._config_with(datafile=self._multi_path))
         emailer.send_emails('Fake subject', 'Fake message')
 
         self.assertTrue(mock_smtp.called)
         self.assertTrue(mock_server.login.called)
-        self.assertTrue(mock_server.sendmail.call_count == 3)
+        self.assertTrue(mock_server.send_message.call_count == 3)
+
+    @patch('emailer.smtplib.SMTP')
+    def test_send_emails_concurrently(self, mock_smtp):
+        """Sends multiple emails over several SMTP connections.
+
+        When the config structure asks for more than one connection to
+        the email server, we verify that each connection is logged in to
+        and closed, and that each recipient still gets a single email.
+        """
+
+        # Create a mock object for the SMTP server that the Emailer
+        # module uses (the return value from a call to smtplib.SMTP).
+        mock_server = MagicMock()
+        mock_smtp.return_value = mock_server
+
+        # Use our email sending class to send a fake email to the
+        # recipients in the multiple-entry emails file, over two
+        # connections to the email server.
+        emailer = Emailer(self._config_with(datafile=self._multi_path, concurrency=2))
+        emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_smtp.call_count == 2)
+        self.assertTrue(mock_server.login.call_count == 2)
+        self.assertTrue(mock_server.quit.call_count == 2)
+
+        # The emails are sent from two threads at once, and a mock's
+        # call_count can lose calls made at the same time, so we check
+        # the recipients of the calls it recorded instead.
+        receivers = sorted(call[0][2][0] for call in mock_server.send_message.call_args_list)
+        self.assertEqual(receivers, ['first.recipient@whatever.com',
+                                     'second.recipient@whatever.com',
+                                     'third.recipient@whatever.com'])
+
+    @patch('emailer.smtplib.SMTP')
+    def test_connections_limited_to_recipients(self, mock_smtp):
+        """Opens no more connections than there are emails to send.
+
+        When the config structure asks for more connections to the email
+        server than there are recipients, we verify that only one
+        connection per recipient is opened, and that none is opened when
+        there are no recipients at all.
+        """
+
+        # Create a mock object for the SMTP server that the Emailer
+        # module uses (the return value from a call to smtplib.SMTP).
+        mock_server = MagicMock()
+        mock_smtp.return_value = mock_server
+
+        emailer = Emailer(self._config_with(datafile=self._single_path, concurrency=3))
+        emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_smtp.call_count == 1)
+        self.assertTrue(mock_server.send_message.call_count == 1)
+
+        # A missing emails file means there's no one to send to.
+        emailer = Emailer(self._config_with(
+            datafile=os.path.join(self._test_dir, 'missing.txt'), concurrency=3))
+        with patch('builtins.print'):
+            emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_smtp.call_count == 1)
+
+    @patch('emailer.smtplib.SMTP')
+    def test_padded_emails_file(self, mock_smtp):
+        """Ignores spaces around the names and addresses in the emails file.
+
+        When a line of the emails file has spaces before or after the
+        comma or at the end, we verify that the email goes to the
+        address without them, addressed to the name without them.
+        """
+
+        padded_path = os.path.join(self._test_dir, 'padded.txt')
+        with open(padded_path, 'w') as emails_file:
+            emails_file.write('First Recipient , first.recipient@whatever.com \n')
+
+        # Create a mock object for the SMTP server that the Emailer
+        # module uses (the return value from a call to smtplib.SMTP).
+        mock_server = MagicMock()
+        mock_smtp.return_value = mock_server
+
+        emailer = Emailer(self._config_with(datafile=padded_path))
+        emailer.send_emails('Fake subject', 'Fake message')
+
+        (message, _, receivers) = mock_server.send_message.call_args[0]
+        self.assertEqual(receivers, ['first.recipient@whatever.com'])
+        self.assertEqual(message['To'], 'First Recipient <first.recipient@whatever.com>')
+
+    @patch('emailer.smtplib.SMTP')
+    def test_emails_file_changed(self, mock_smtp):
+        """Picks up changes to the emails file between sends.
+
+        The emails file is only read again when it changes, so we verify
+        that after adding recipients to the file, the next send goes to
+        all of them.
+        """
+
+        # Create an emails file with a single entry.  This test changes
+        # the file, so it gets its own rather than a shared one.
+        changing_path = os.path.join(self._test_dir, 'changing.txt')
+        with open(changing_path, 'w') as emails_file:
+            emails_file.write('First Recipient, first.recipient@whatever.com')
+
+        # Create a mock object for the SMTP server that the Emailer
+        # module uses (the return value from a call to smtplib.SMTP).
+        mock_server = MagicMock()
+        mock_smtp.return_value = mock_server
+
+        # Use our email sending class to send a fake email.
+        emailer = Emailer(self._config_with(datafile=changing_path))
+        emailer.send_emails('Fake subject', 'Fake message')
+
+        # Add two more recipients to the file and send again.
+        with open(changing_path, 'a') as emails_file:
+            emails_file.write('\nSecond Recipient, second.recipient@whatever.com\n')
+            emails_file.write('Third Recipient, third.recipient@whatever.com')
+
+        emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_server.send_message.call_count == 4)
+
+    @patch('emailer.smtplib.SMTP')
+    def test_connect_failure(self, mock_smtp):
+        """Closes the connections already opened when one can't be made.
+
+        When logging in to one of several connections to the email server
+        fails, we verify that the error is raised and that the
+        connections which were already open are closed.
+        """
+
+        # The second of three connections can't be logged in to.
+        mock_servers = [MagicMock(), MagicMock(), MagicMock()]
+        mock_servers[1].login.side_effect = smtplib.SMTPAuthenticationError(535, b'Bad login')
+        mock_smtp.side_effect = mock_servers
+
+        emailer = Emailer(self._config_with(datafile=self._multi_path, concurrency=3))
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_servers[0].quit.call_count == 1)
+        self.assertTrue(mock_servers[1].close.call_count == 1)
+        self.assertTrue(mock_smtp.call_count == 2)
+
+    @patch('emailer.smtplib.SMTP')
+    def test_send_failure_closes_connections(self, mock_smtp):
+        """Closes every connection, and keeps the error, when a send fails.
+
+        When sending over a connection fails because the server dropped
+        it, logging out of that connection fails too.  We verify that
+        it's closed instead, that the other connection is still logged
+        out of, and that the send error is the one raised.
+        """
+
+        # The first connection is dropped by the server.
+        mock_servers = [MagicMock(), MagicMock()]
+        mock_servers[0].send_message.side_effect = smtplib.SMTPServerDisconnected('Dropped')
+        mock_servers[0].quit.side_effect = smtplib.SMTPServerDisconnected('Not connected')
+        mock_smtp.side_effect = mock_servers
+
+        emailer = Emailer(self._config_with(datafile=self._multi_path, concurrency=2))
+        with self.assertRaisesRegex(smtplib.SMTPServerDisconnected, 'Dropped'):
+            emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_servers[0].close.call_count == 1)
+        self.assertTrue(mock_servers[1].quit.call_count == 1)
+
+    @patch.object(SMTPPool, '_MAX_MESSAGES_PER_CONNECTION', 1)
+    @patch('emailer.smtplib.SMTP')
+    def test_reconnect_failure(self, mock_smtp):
+        """Doesn't reuse a connection that was logged out of to be replaced.
+
+        When a connection that has sent its limit of messages can't be
+        replaced, we verify that the old connection isn't used or logged
+        out of again, and that the next message gets a new connection.
+        """
+
+        # Replacing the first connection fails once, then works.
+        mock_servers = [MagicMock(), OSError('Connection refused'), MagicMock()]
+        mock_smtp.side_effect = mock_servers
+
+        emailer = Emailer(self._config_with(datafile=self._multi_path))
+        with self.assertRaises(OSError):
+            emailer.send_emails('Fake subject', 'Fake message')
+
+        self.assertTrue(mock_servers[0].send_message.call_count == 1)
+        self.assertTrue(mock_servers[0].quit.call_count == 1)
+        self.assertTrue(mock_servers[2].send_message.call_count == 1)
+        self.assertTrue(mock_servers[2].quit.call_count == 1)
 
     @patch('emailer.smtplib.SMTP')
     def test_send_one_email_no_tls(self, mock_smtp):
@@ -100,26 +328,21 @@ class EmailerTestCase(unittest.TestCase):
         the email server, we make sure to not call the 'starttls' method.
         """
 
-        # Create an emails file with a single entry.
-        with open(self._TEST_FILE, 'w') as emails_file:
-            emails_file.write('First Recipient, first.recipient@whatever.com')
-
         # Create a mock object for the SMTP server that the Emailer
         # module uses (the return value from a call to smtplib.SMTP).
         mock_server = MagicMock()
         mock_smtp.return_value = mock_server
 
-        # Mark the SMTP server we use as not accepting TLS.
-        self._mock_config['smtp']['tls'] = False
-
-        # Use our email sending class to send a fake email.
-        emailer = Emailer(self._mock_config)
+        # Use our email sending class to send a fake email to the
+        # recipient in the single-entry emails file, marking the SMTP
+        # server we use as not accepting TLS.
+        emailer = Emailer(self._config_with(datafile=self._single_path, tls=False))
         emailer.send_emails('Fake subject', 'Fake message')
 
         self.assertTrue(mock_smtp.called)
         self.assertTrue(mock_server.login.called)
         self.assertFalse(mock_server.starttls.called)
-        self.assertTrue(mock_server.sendmail.call_count == 1)
+        self.assertTrue(mock_server.send_message.call_count == 1)
 
     @patch('emailer.smtplib.SMTP')
     def test_inline_recipients(self, mock_smtp):
@@ -130,12 +353,10 @@ class EmailerTestCase(unittest.TestCase):
         module can handle this.
         """
 
-        # Create a config structure with inline email recipients.  We
-        # have to be careful not to corrupt the base config structure
-        # used by all other tests, though, so we make a deep copy.
-        inline_config = copy.deepcopy(self._mock_config)
-        inline_config['smtp']['datafile'] = '{"first.recipient@there.com": "First Recipient",'
-        inline_config['smtp']['datafile'] += '"second.recipient@there.com": "Second Recipient"}'
+        # Create a config structure with inline email recipients.
+        inline_config = self._config_with(
+            datafile='{"first.recipient@there.com": "First Recipient",'
+                     '"second.recipient@there.com": "Second Recipient"}')
 
         # Create a mock object for the SMTP server that the Emailer
         # module uses (the return value from a call to smtplib.SMTP).
@@ -148,7 +369,7 @@ class EmailerTestCase(unittest.TestCase):
 
         self.assertTrue(mock_smtp.called)
         self.assertTrue(mock_server.login.called)
-        self.assertTrue(mock_server.sendmail.call_count == 2)
+        self.assertTrue(mock_server.send_message.call_count == 2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+"""Test suite for the main module's configuration handling"""
+
+import copy
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import main
+from testutil import text_only_loads
+
+
+class ConfigurationTestCase(unittest.TestCase):
+    """Unit tests for environment variable and command-line processing"""
+
+    _base_config = {
+        'tesla_connect' : {
+            'username' : 'me@myplace.com',
+            'password' : 'pAssw0rd',
+            'home_location' : {
+                'latitude' : 28.50,
+                'longitude' : -101.01
+            }
+        },
+        'twilio' : {
+            'datafile' : 'phone_numbers.txt'
+        },
+        'smtp' : {
+            'datafile' : 'emails.txt',
+            'smtp_server' : 'smtp.fakeserver.com',
+            'smtp_port' : 587,
+            'tls' : True
+        },
+        'send_email' : False,
+        'logging_level' : logging.WARNING
+    }
+
+    def test_environment_vars(self):
+        """Replaces settings with the environment variables that are set.
+
+        Environment variables should replace the matching settings,
+        converted to the right type, and leave every other setting alone.
+        """
+
+        environment = {
+            'TESLAALERT_USERNAME' : 'you@yourplace.com',
+            'TESLAALERT_HOME_LATITUDE' : '47.61',
+            'TESLAALERT_SMTP_PORT' : '25',
+            'TESLAALERT_SMTP_USE_TLS' : '0',
+            'TESLAALERT_SEND_EMAIL' : '1',
+            'TESLAALERT_LOGGING_LEVEL' : 'debug'
+        }
+        with patch.dict(os.environ, environment, clear=True):
+            config = main.process_environment_vars(copy.deepcopy(self._base_config))
+
+        self.assertEqual(config['tesla_connect']['username'], 'you@yourplace.com')
+        self.assertEqual(config['tesla_connect']['password'], 'pAssw0rd')
+        self.assertEqual(config['tesla_connect']['home_location']['latitude'], 47.61)
+        self.assertEqual(config['smtp']['smtp_port'], 25)
+        self.assertIs(config['smtp']['tls'], False)
+        self.assertIs(config['send_email'], True)
+        self.assertEqual(config['logging_level'], logging.DEBUG)
+
+    def test_environment_booleans(self):
+        """Accepts words as well as numbers for boolean settings."""
+
+        environment = {
+            'TESLAALERT_SMTP_USE_TLS' : 'False',
+            'TESLAALERT_SEND_EMAIL' : 'yes'
+        }
+        with patch.dict(os.environ, environment, clear=True):
+            config = main.process_environment_vars(copy.deepcopy(self._base_config))
+
+        self.assertIs(config['smtp']['tls'], False)
+        self.assertIs(config['send_email'], True)
+
+    def test_inline_config(self):
+        """Loads the configuration from an environment variable.
+
+        When the whole configuration is passed in an environment
+        variable, we want to use it instead of the configuration file.
+        """
+
+        environment = {
+            'TESLAALERT_CONFIG_JSON' : '{"send_email": true, "logging_level": "error"}'
+        }
+        with patch.dict(os.environ, environment, clear=True):
+            with patch('main.open') as mock_open:
+                config = main.load_configuration_file()
+
+        self.assertFalse(mock_open.called)
+        self.assertIs(config['send_email'], True)
+        self.assertEqual(config['logging_level'], logging.ERROR)
+
+    @patch('main.json_loads', text_only_loads)
+    def test_config_file(self):
+        """Loads the configuration from the config.json file.
+
+        When the configuration isn't passed in an environment variable,
+        we want it read from the config.json file in the current
+        directory.
+        """
+
+        original_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as config_dir:
+            with open(os.path.join(config_dir, 'config.json'), 'w') as config_file:
+                json.dump({'send_email' : True, 'logging_level' : 'info'}, config_file)
+
+            os.chdir(config_dir)
+            try:
+                with patch.dict(os.environ, {}, clear=True):
+                    config = main.load_configuration_file()
+            finally:
+                os.chdir(original_dir)
+
+        self.assertIs(config['send_email'], True)
+        self.assertEqual(config['logging_level'], logging.INFO)
+
+    def test_command_line(self):
+        """Replaces settings with the command-line options given."""
+
+        argv = ['main.py', '-u', 'you@yourplace.com', '--longitude', '-122.33', '-e',
+                '--loglevel', 'info']
+        config = main.process_command_line(copy.deepcopy(self._base_config), argv)
+
+        self.assertEqual(config['tesla_connect']['username'], 'you@yourplace.com')
+        self.assertEqual(config['tesla_connect']['home_location']['longitude'], -122.33)
+        self.assertIs(config['send_email'], True)
+        self.assertEqual(config['logging_level'], logging.INFO)
+
+    @patch('main.socket.getaddrinfo')
+    @patch('main.Emailer')
+    @patch('main.MessageSender')
+    @patch('main.charge_status.check_plugin_status_all')
+    @patch('main.load_configuration_file')
+    def test_send_alerts(self, mock_load, mock_check, mock_sender, mock_emailer,
+                         mock_getaddrinfo):
+        """Sends both text messages and emails about unplugged cars.
+
+        When a car is unplugged and email is turned on, we want both the
+        text messages and the emails to be sent, and the addresses of
+        both services to have been looked up ahead of time.
+        """
+
+        mock_load.return_value = copy.deepcopy(self._base_config)
+        mock_check.return_value = {'111' : 'foo'}
+
+        with patch.dict(os.environ, {}, clear=True), patch('builtins.print'):
+            main.main(['main.py', '--email'])
+
+        self.assertTrue(mock_sender.return_value.send_sms.call_count == 1)
+        self.assertTrue(mock_emailer.return_value.send_emails.call_count == 1)
+
+        # The lookups run on two threads at once, and a mock's call_count
+        # can lose calls made at the same time, so we check the hosts of
+        # the calls it recorded instead.
+        hosts = {call[0][0] for call in mock_getaddrinfo.call_args_list}
+        self.assertEqual(hosts, {'api.twilio.com', 'smtp.fakeserver.com'})
+
+
+if __name__ == '__main__':
+    unittest.main()
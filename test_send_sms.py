@@ -1,118 +1,189 @@
 """Test suite for the MessageSender class"""
 
-import copy
 import logging
-import os
-import unittest
-from unittest.mock import patch, MagicMock
+import types
+from unittest.mock import Mock
 
+import pytest
+
+import send_sms
 from send_sms import MessageSender
 
 
-class MessageSenderTestCase(unittest.TestCase):
-    """Unit tests for the MessageSender class"""
+# The tests check what gets sent rather than what gets logged, so when
+# nothing else has set up logging, MessageSender's records are dropped
+# instead of going to the logging module's last-resort stderr handler.
+logging.getLogger('send_sms').addHandler(logging.NullHandler())
+
+# Recipients given inline in the config structure, rather than in a file.
+_INLINE_RECIPIENTS = '{"+14255551212": "First Recipient", "+14255551213": "Second Recipient"}'
 
-    _TEST_FILE = 'test_numbers.txt'
+_SINGLE_PATH = 'single.txt'
+_MULTI_PATH = 'multi.txt'
 
-    def setUp(self):
-        pass
 
-    def tearDown(self):
-        try:
-            os.remove(self._TEST_FILE)
-        except FileNotFoundError:
-            pass
+@pytest.fixture
+def mock_config():
+    """Base config structure for the tests.
 
-    _mock_config = {
-        'twilio' : {
-            'datafile' : _TEST_FILE,
+    It's read-only, and tests which need different settings make their
+    own with _config_with().
+    """
+
+    return types.MappingProxyType({
+        'twilio' : types.MappingProxyType({
+            'datafile' : _SINGLE_PATH,
             'account_sid' : 'FAKE',
             'auth_token' : 'baadf00d',
             'sending_number' : '+14258675309'
-        },
-        'logging_level' : logging.DEBUG
-    }
-
-    @patch('send_sms.TwilioRestClient')
-    def test_send_one_message(self, mock_client):
-        """Sends a single message using MessageSender.
-
-        When there is just a single user recipient in the list we use
-        for sending messages, we verify that a single call to the Twilio
-        service is made to send the message.
-        """
-
-        # Create a phone numbers file with a single entry.
-        with open(self._TEST_FILE, 'w') as numbers_file:
-            numbers_file.write('First Recipient, +14255551212')
-
-        # Create a mock object for the result of the call to
-        # TwilioRestClient.messages, which is used by MessageSender.
-        mock_instance = mock_client.return_value
-        mock_instance.messages = MagicMock()
-
-        # Use our message sending class to send a fake message.
-        sms_sender = MessageSender(self._mock_config)
-        sms_sender.send_sms('Fake subject', 'Fake message')
+        }),
+        'logging_level' : logging.WARNING
+    })
 
-        self.assertTrue(mock_client.called)
-        self.assertTrue(mock_instance.messages.create.call_count == 1)
+@pytest.fixture
+def mock_client(monkeypatch):
+    """Mock object in place of the Twilio REST client.
 
-    @patch('send_sms.TwilioRestClient')
-    def test_send_multiple_messages(self, mock_client):
-        """Sends multiple messages using MessageSender.
+    The result of the call to TwilioRestClient.messages is what
+    MessageSender uses, and its create() method is the only one
+    MessageSender calls, so that's the only one the mock provides.
+    """
 
-        When there are multiple recipients in the list we use for
-        sending messages, we verify that a call to the Twilio service
-        is made once per recipient.
-        """
+    client = Mock()
+    client.return_value.messages = Mock(spec=['create'])
+    monkeypatch.setattr(send_sms, 'TwilioRestClient', client)
+    return client
 
-        # Create a phone numbers file with a multiple entries.
-        with open(self._TEST_FILE, 'w') as numbers_file:
-            numbers_file.write('First Recipient, +14255551212\n')
-            numbers_file.write('Second Recipient, +14255551213\n')
-            numbers_file.write('Third Recipient, +14255551214')
+@pytest.fixture
+def numbers_files(fs):
+    """Phone numbers files with a single entry and with multiple entries.
 
-        # Create a mock object for the result of the call to
-        # TwilioRestClient.messages, which is used by MessageSender.
-        mock_instance = mock_client.return_value
-        mock_instance.messages = MagicMock()
+    The files only ever exist in an in-memory fake filesystem, which
+    goes away after each test, so there's nothing to clean up on disk.
+    """
 
-        # Use our message sending class to send a fake message.
-        sms_sender = MessageSender(self._mock_config)
-        sms_sender.send_sms('Fake subject', 'Fake message')
+    fs.create_file(_SINGLE_PATH, contents='First Recipient, +14255551212')
+    fs.create_file(_MULTI_PATH,
+                   contents='First Recipient, +14255551212\n'
+                            'Second Recipient, +14255551213\n'
+                            'Third Recipient, +14255551214')
+
+def _config_with(config, **twilio_settings):
+    """Return a copy of a config with some Twilio settings replaced.
+
+    Only the dictionaries on the way to the replaced settings are
+    copied, as the base config structure itself is read-only.
+    """
+
+    return {**config, 'twilio' : {**config['twilio'], **twilio_settings}}
+
+def _recipients(create):
+    """Return the sorted phone numbers a mock create() method sent to.
+
+    MessageSender calls create() from several threads at once, and a
+    mock's call_count can lose calls made at the same time, so we go by
+    the calls it recorded instead.
+    """
+
+    return sorted(call[1]['to'] for call in create.call_args_list)
+
+def test_send_one_message(mock_config, mock_client, numbers_files):
+    """Sends a single message using MessageSender.
+
+    When there is just a single user recipient in the list we use
+    for sending messages, we verify that a single call to the Twilio
+    service is made to send the message.
+    """
+
+    mock_instance = mock_client.return_value
+
+    # Use our message sending class to send a fake message to the
+    # recipient in the single-entry phone numbers file.
+    sms_sender = MessageSender(_config_with(mock_config, datafile=_SINGLE_PATH))
+    sms_sender.send_sms('Fake subject', 'Fake message')
 
-        self.assertTrue(mock_client.called)
-        self.assertTrue(mock_instance.messages.create.call_count == 3)
+    assert mock_client.called
+    assert _recipients(mock_instance.messages.create) == ['+14255551212']
 
-    @patch('send_sms.TwilioRestClient')
-    def test_inline_recipients(self, mock_client):
-        """Sends to recipients listed directly in config structure.
+def test_send_multiple_messages(mock_config, mock_client, numbers_files):
+    """Sends multiple messages using MessageSender.
 
-        If the config structure doesn't contain a file name, but rather
-        has the recipients listed inline, we verify that that the SMS
-        sending module can handle this.
-        """
+    When there are multiple recipients in the list we use for
+    sending messages, we verify that a call to the Twilio service
+    is made once per recipient.
+    """
 
-        # Create a config structure with inline SMS recipients.  We
-        # have to be careful not to corrupt the base config structure
-        # used by all other tests, though, so we make a deep copy.
-        inline_config = copy.deepcopy(self._mock_config)
-        inline_config['twilio']['datafile'] = '{"+14255551212": "First Recipient",'
-        inline_config['twilio']['datafile'] += '"+14255551213": "Second Recipient"}'
+    mock_instance = mock_client.return_value
 
-        # Create a mock object for the result of the call to
-        # TwilioRestClient.messages, which is used by MessageSender.
-        mock_instance = mock_client.return_value
-        mock_instance.messages = MagicMock()
+    # Use our message sending class to send a fake message to the
+    # recipients in the multiple-entry phone numbers file.
+    sms_sender = MessageSender(_config_with(mock_config, datafile=_MULTI_PATH))
+    sms_sender.send_sms('Fake subject', 'Fake message')
 
-        # Use our message sending class to send a fake message.
-        sms_sender = MessageSender(inline_config)
+    assert mock_client.called
+    assert _recipients(mock_instance.messages.create) == [
+        '+14255551212', '+14255551213', '+14255551214']
+
+def test_padded_numbers_file(mock_config, mock_client, fs):
+    """Ignores spaces around the names and numbers in the numbers file.
+
+    When a line of the phone numbers file has spaces before or after the
+    comma or at the end, we verify that the message goes to the number
+    without them, and greets the name without them.
+    """
+
+    fs.create_file('padded.txt', contents='First Recipient , +14255551212 \n')
+
+    mock_instance = mock_client.return_value
+
+    sms_sender = MessageSender(_config_with(mock_config, datafile='padded.txt'))
+    sms_sender.send_sms('Fake subject', 'Fake message')
+
+    assert _recipients(mock_instance.messages.create) == ['+14255551212']
+    assert 'Hi First Recipient,' in mock_instance.messages.create.call_args[1]['body']
+
+def test_send_message_failure(mock_config, mock_client, numbers_files, caplog):
+    """Keeps sending messages when one of them fails.
+
+    When the Twilio service fails to send a message to one of the
+    recipients, we verify that the failure is logged rather than
+    raised, and that the other recipients still get their messages.
+    """
+
+    # Make sending to the first recipient raise an exception.
+    def create(to, **kwargs):
+        if to == '+14255551212':
+            raise RuntimeError('Fake failure')
+
+    mock_instance = mock_client.return_value
+    mock_instance.messages.create.side_effect = create
+
+    # Use our message sending class to send a fake message to the
+    # recipients in the multiple-entry phone numbers file.
+    sms_sender = MessageSender(_config_with(mock_config, datafile=_MULTI_PATH))
+    with caplog.at_level(logging.ERROR, logger='send_sms'):
         sms_sender.send_sms('Fake subject', 'Fake message')
 
-        self.assertTrue(mock_client.called)
-        self.assertTrue(mock_instance.messages.create.call_count == 2)
+    assert [record.levelno for record in caplog.records] == [logging.ERROR]
+    assert _recipients(mock_instance.messages.create) == [
+        '+14255551212', '+14255551213', '+14255551214']
+
+def test_inline_recipients(mock_config, mock_client):
+    """Sends to recipients listed directly in config structure.
+
+    If the config structure doesn't contain a file name, but rather
+    has the recipients listed inline, we verify that that the SMS
+    sending module can handle this.
+    """
+
+    # Create a config structure with inline SMS recipients.
+    inline_config = _config_with(mock_config, datafile=_INLINE_RECIPIENTS)
+
+    mock_instance = mock_client.return_value
 
+    # Use our message sending class to send a fake message.
+    sms_sender = MessageSender(inline_config)
+    sms_sender.send_sms('Fake subject', 'Fake message')
 
-if __name__ == '__main__':
-    unittest.main()
+    assert mock_client.called
+    assert _recipients(mock_instance.messages.create) == ['+14255551212', '+14255551213']
@@ -1,10 +1,68 @@
 """Test suite for the TeslaConnect class"""
 
+import json
+import os
+import tempfile
+import time
 import unittest
-from unittest.mock import patch
-import re
+from unittest.mock import patch, DEFAULT
+
+import requests
 
 from tesla_connect import TeslaConnect
+from testutil import text_only_loads
+
+
+# Lists of vehicles in the user's account, as returned by the Tesla
+# servers, for the get_vehicles() tests.
+_VEHICLES_1 = [
+    {'id_s' : '888', 'display_name' : 'foo', 'in_service' : False}
+]
+_VEHICLES_2 = [
+    {'id_s' : '111', 'display_name' : 'foo', 'in_service' : False},
+    {'id_s' : '222', 'display_name' : 'bar', 'in_service' : False}
+]
+_VEHICLES_3 = [
+    {'id_s' : '111', 'display_name' : 'foo', 'in_service' : False},
+    {'id_s' : '222', 'display_name' : 'bar', 'in_service' : False},
+    {'id_s' : '333', 'display_name' : 'baz', 'in_service' : False}
+]
+_VEHICLES_MIXED_SERVICE = [
+    {'id_s' : '111', 'display_name' : 'foo', 'in_service' : True},
+    {'id_s' : '222', 'display_name' : 'bar', 'in_service' : False}
+]
+
+# Payloads of the responses to the mobile-enabled checks.
+_ENABLED_RESP = {'response' : True}
+_DISABLED_RESP = {'response' : False}
+
+
+def make_get_response(mock_get, vehicles, mobile_enabled=lambda url: True):
+    """Set up the responses of the mock requests.Session.get() method.
+
+    get_vehicles() calls get() multiple times:  once to get the list of
+    vehicles in the user's Tesla account, and then once more for each
+    vehicle, to see if it's enabled for mobile access.  The response to
+    each of those URLs is built up front, with the mobile-enabled ones
+    given by the mobile_enabled predicate, and each call gets the
+    response for the URL it asked for.  The mobile-enabled checks run
+    concurrently, so it's the URL, not the order of the calls, which
+    decides what a call gets back.
+    """
+
+    def make_response(payload):
+        response = TeslaConnectTestCase.MockRequestResponse()
+        response.json = lambda: payload
+        return response
+
+    responses = {
+        TeslaConnect._portal : make_response({'count' : len(vehicles), 'response' : vehicles})
+    }
+    for vehicle in vehicles:
+        url = TeslaConnect._mobile_enabled_url.format(vehicle['id_s'])
+        responses[url] = make_response(_ENABLED_RESP if mobile_enabled(url) else _DISABLED_RESP)
+
+    mock_get.side_effect = lambda url, **kwargs: responses[url]
 
 
 class TeslaConnectTestCase(unittest.TestCase):
@@ -18,6 +76,8 @@ class TeslaConnectTestCase(unittest.TestCase):
         to be overwritten, either through direct replacement or derivation.
         """
 
+        status_code = 200
+
         def json(self):
             """Placeholder version of the json() method.
 
@@ -27,8 +87,46 @@ class TeslaConnectTestCase(unittest.TestCase):
 
             pass
 
+        @property
+        def text(self):
+            """Body of the response, as returned by the requests module.
+
+            TeslaConnect parses the body itself, so we give it the JSON
+            text of whatever payload the json() method provides.
+            """
+
+            return json.dumps(self.json())
+
+    @classmethod
+    def setUpClass(cls):
+        # The mock instance of the requests.Session.post() method needs to
+        # only return an object which has a json() method which contains an
+        # 'access_token' attribute.  It doesn't matter what the attribute
+        # value is, as it's opaque to TeslaConnect.  Thus, we can easily
+        # simulate the response object's behavior with a simple lambda
+        # expression, and the same response object does for every test.
+        cls._ACCESS_TOKEN_RESPONSE = cls.MockRequestResponse()
+        cls._ACCESS_TOKEN_RESPONSE.json = lambda: {'access_token' : 'foo'}
+
+        # TeslaConnect only logs in when it's created, and get_vehicles()
+        # keeps nothing between calls, so the get_vehicles() tests share
+        # one instance, created under class-wide mocks of the requests
+        # methods.  Tests which need a TeslaConnect of their own patch
+        # the methods again, over the class-wide mocks.
+        cls._patcher = patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+        mocks = cls._patcher.start()
+        cls._mock_post = mocks['post']
+        cls._mock_get = mocks['get']
+
+        cls._mock_post.return_value = cls._ACCESS_TOKEN_RESPONSE
+        cls._tesla = TeslaConnect(cls._mock_config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._patcher.stop()
+
     def setUp(self):
-        pass
+        self._mock_get.reset_mock()
 
     _mock_config = {
         'username' : 'me@myplace.com',
@@ -39,272 +137,217 @@ class TeslaConnectTestCase(unittest.TestCase):
         }
     }
 
-    @patch('requests.post')
-    @patch('requests.get')
-    def test_get_vehicles_1(self, mock_get, mock_post):
-        """Gets a single vehicle when just one is in the user's account.
-
-        When there is just a single mobile-enabled vehicle in the user's
-        account, we want to make sure that is what is returned.
+    def test_get_vehicles_parameterized(self):
+        """Gets the vehicles which can be checked from the user's account.
+
+        Each case is a list of the vehicles in the user's account, which
+        of them are mobile-enabled, and how many of them we want returned:
+
+        - When there is just a single mobile-enabled vehicle in the
+          user's account, we want to make sure that is what is returned.
+        - When there are multiple mobile-enabled vehicles in the user's
+          account, we want to make sure that they're all returned.
+        - When there are multiple vehicles in the user's account, but
+          not all of them are mobile-enabled, we want to make sure that
+          only those that are mobile-enabled are returned.
+        - When a vehicle is marked as being in service, we want to
+          exclude it from our list of available vehicles that we check
+          for being disconnected.
         """
 
-        # The mock instance of the requests.post() method needs to only
-        # return an object which has a json() method which contains an
-        # 'access_token' attribute.  It doesn't matter what the attribute
-        # value is, as it's opaque to TeslaConnect.  Thus, we can easily
-        # simulate the response object's behavior with a simple lambda
-        # expression.  The mock instance of the requests.get() method is a
-        # little more complicated, as explained below.
+        cases = [
+            (_VEHICLES_1, lambda url: True, 1),
+            (_VEHICLES_3, lambda url: True, 3),
+            (_VEHICLES_2, lambda url: url.endswith('222/mobile_enabled'), 1),
+            (_VEHICLES_MIXED_SERVICE, lambda url: True, 1)
+        ]
 
-        mock_response_post = self.MockRequestResponse()
-        mock_response_post.json = lambda: {'access_token' : 'foo'}
-        mock_post.return_value = mock_response_post
+        for (i, (vehicles_list, mobile_enabled, expected_count)) in enumerate(cases):
+            with self.subTest(case=i):
+                make_get_response(self._mock_get, vehicles_list, mobile_enabled)
 
-        class MockRequestResponseGet(self.MockRequestResponse):
-            """Class implementing the response behavior of requests.get().
+                vehicles = self._tesla.get_vehicles()
 
-            The mock instance of the requests.get() method is a little more
-            complicated because we call it multiple times in get_vehicles():
-            once to get the list of vehicles in the user's Tesla account,
-            and then once more for each vehicle, to see if it's enabled for
-            mobile access.
-            """
+                self.assertTrue(len(vehicles) == expected_count)
+
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_vehicle_snapshot(self, post, get):
+        """Checks a car's location and charge state with a single request.
 
-            def __init__(self, mock_get):
-                self._mock_get = mock_get
-
-            def json(self):
-                if self._mock_get.call_count == 1:
-                    return {
-                        'count' : 1,
-                        'response' : [
-                            {
-                                'id_s' : '888',
-                                'display_name' : 'foo',
-                                'in_service' : False
-                            }
-                        ]
-                    }
-                elif self._mock_get.call_count > 1:
-                    return {
-                        'response' : True
-                    }
-
-        mock_response_get = MockRequestResponseGet(mock_get)
-        mock_get.return_value = mock_response_get
+        The at-home and unplugged checks both read from the same vehicle
+        data, so we want to make sure that only one request is made to
+        the Tesla servers to answer both of them.
+        """
+
+        post.return_value = self._ACCESS_TOKEN_RESPONSE
+
+        mock_response_get = self.MockRequestResponse()
+        mock_response_get.json = lambda: {
+            'response' : {
+                'drive_state' : {
+                    'latitude' : 28.5001,
+                    'longitude' : -101.0102
+                },
+                'charge_state' : {
+                    'charging_state' : 'Disconnected'
+                }
+            }
+        }
+        get.return_value = mock_response_get
 
         tesla = TeslaConnect(self._mock_config)
-        vehicles = tesla.get_vehicles()
 
-        self.assertTrue(len(vehicles) == 1)
+        self.assertTrue(tesla.is_car_at_home('888'))
+        self.assertTrue(tesla.is_car_unplugged('888'))
+        self.assertTrue(get.call_count == 1)
 
-    @unittest.mock.patch('requests.post')
-    @unittest.mock.patch('requests.get')
-    def test_get_vehicles_3(self, mock_get, mock_post):
-        """Gets multiple vehicles.
+    def test_get_vehicles_unchecked(self):
+        """Gets vehicles without checking whether they're mobile-enabled.
 
-        When there are multiple mobile-enabled vehicles in the user's
-        account, we want to make sure that they're all returned.
+        When the caller asks us not to check whether vehicles are
+        mobile-enabled, we want to make sure that only the request for
+        the vehicle list is made, and that cars in service are still
+        left out.
         """
 
-        # The mock instance of the requests.post() method needs to only
-        # return an object which has a json() method which contains an
-        # 'access_token' attribute.  It doesn't matter what the attribute
-        # value is, as it's opaque to TeslaConnect.  Thus, we can easily
-        # simulate the response object's behavior with a simple lambda
-        # expression.  The mock instance of the requests.get() method is a
-        # little more complicated, as explained below.
+        make_get_response(self._mock_get, _VEHICLES_MIXED_SERVICE)
 
-        mock_response_post = self.MockRequestResponse()
-        mock_response_post.json = lambda: {'access_token' : 'foo'}
-        mock_post.return_value = mock_response_post
+        vehicles = self._tesla.get_vehicles(check_mobile_enabled=False)
 
-        class MockRequestResponseGet(self.MockRequestResponse):
-            """Class implementing the response behavior of requests.get().
+        self.assertTrue(len(vehicles) == 1)
+        self.assertTrue(self._mock_get.call_count == 1)
 
-            The mock instance of the requests.get() method is a little more
-            complicated because we call it multiple times in get_vehicles():
-            once to get the list of vehicles in the user's Tesla account,
-            and then once more for each vehicle, to see if it's enabled for
-            mobile access.
-            """
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_vehicle_data_unavailable(self, post, get):
+        """Treats a car whose data can't be had as away and plugged in.
 
-            def __init__(self, mock_get):
-                self._mock_get = mock_get
-
-            def json(self):
-                if self._mock_get.call_count == 1:
-                    return {
-                        'count' : 3,
-                        'response' : [
-                            {
-                                'id_s' : '111',
-                                'display_name' : 'foo',
-                                'in_service' : False
-                            },
-                            {
-                                'id_s' : '222',
-                                'display_name' : 'bar',
-                                'in_service' : False
-                            },
-                            {
-                                'id_s' : '333',
-                                'display_name' : 'baz',
-                                'in_service' : False
-                            }
-                        ]
-                    }
-                elif self._mock_get.call_count > 1:
-                    return {
-                        'response' : True
-                    }
-
-        mock_response_get = MockRequestResponseGet(mock_get)
-        mock_get.return_value = mock_response_get
+        When the request for a car's vehicle data fails (as it does for
+        cars that aren't mobile-enabled), we want that car skipped rather
+        than reported.
+        """
+
+        post.return_value = self._ACCESS_TOKEN_RESPONSE
+
+        mock_response_get = self.MockRequestResponse()
+        mock_response_get.status_code = 408
+        get.return_value = mock_response_get
 
         tesla = TeslaConnect(self._mock_config)
-        vehicles = tesla.get_vehicles()
 
-        self.assertTrue(len(vehicles) == 3)
+        self.assertFalse(tesla.is_car_at_home('888'))
+        self.assertFalse(tesla.is_car_unplugged('888'))
+        self.assertTrue(get.call_count == 1)
 
-    @unittest.mock.patch('requests.post')
-    @unittest.mock.patch('requests.get')
-    def test_mobile_enabled_vehicles(self, mock_get, mock_post):
-        """Account with multiple vehicles, but not all are mobile-enabled.
+    @patch('tesla_connect.json_loads', text_only_loads)
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_token_cache(self, post, get):
+        """Saves the authentication token and reuses it on the next run.
 
-        When there are multiple mobile-enabled vehicles in the user's
-        account, but not all of them are mobile-enabled, we want to make
-        sure that only those that are mobile-enabled are returned.
+        When the config names a token cache file, the first TeslaConnect
+        should log in and save its token there, and the next one should
+        use the saved token without logging in again.
         """
 
-        # The mock instance of the requests.post() method needs to only
-        # return an object which has a json() method which contains an
-        # 'access_token' attribute.  It doesn't matter what the attribute
-        # value is, as it's opaque to TeslaConnect.  Thus, we can easily
-        # simulate the response object's behavior with a simple lambda
-        # expression.  The mock instance of the requests.get() method is a
-        # little more complicated, as explained below.
-
         mock_response_post = self.MockRequestResponse()
-        mock_response_post.json = lambda: {'access_token' : 'foo'}
-        mock_post.return_value = mock_response_post
-
-        class MockRequestResponseGet(self.MockRequestResponse):
-            """Class implementing the response behavior of requests.get().
-
-            The mock instance of the requests.get() method is a little more
-            complicated because we call it multiple times in get_vehicles():
-            once to get the list of vehicles in the user's Tesla account,
-            and then once more for each vehicle, to see if it's enabled for
-            mobile access.
-            """
+        mock_response_post.json = lambda: {'access_token' : 'foo', 'expires_in' : 3888000}
+        post.return_value = mock_response_post
 
-            def __init__(self, mock_get):
-                self._mock_get = mock_get
-
-            def json(self):
-                if self._mock_get.call_count == 1:
-                    return {
-                        'count' : 2,
-                        'response' : [
-                            {
-                                'id_s' : '111',
-                                'display_name' : 'foo',
-                                'in_service' : False
-                            },
-                            {
-                                'id_s' : '222',
-                                'display_name' : 'bar',
-                                'in_service' : False
-                            }
-                        ]
-                    }
-                elif self._mock_get.call_count > 1:
-                    # If this call to get() is to check if car '222' is
-                    # mobile-enabled, we return true, else return false.
-
-                    (arguments, _) = self._mock_get.call_args
-                    if re.search(r'222/mobile_enabled$', arguments[0]):
-                        return {
-                            'response' : True
-                        }
-                    else:
-                        return {
-                            'response' : False
-                        }
-
-        mock_response_get = MockRequestResponseGet(mock_get)
-        mock_get.return_value = mock_response_get
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_config = dict(self._mock_config)
+            cache_config['token_cache'] = os.path.join(cache_dir, 'tesla-alert', 'token.json')
 
-        tesla = TeslaConnect(self._mock_config)
-        vehicles = tesla.get_vehicles()
+            TeslaConnect(cache_config)
+            tesla = TeslaConnect(cache_config)
 
-        self.assertTrue(len(vehicles) == 1)
+            self.assertTrue(post.call_count == 1)
+            self.assertTrue(tesla._session.headers['Authorization'] == 'Bearer foo')
 
-    @unittest.mock.patch('requests.post')
-    @unittest.mock.patch('requests.get')
-    def test_in_service_vehicles(self, mock_get, mock_post):
-        """Account with multiple vehicles, but some are in service.
+    @patch('tesla_connect.json_loads', text_only_loads)
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_token_rejected(self, post, get):
+        """Logs in again when a cached token is rejected.
 
-        When a vehicle is marked as being in service, we want to
-        exclude it from our list of available vehicles that we check
-        for being disconnected.
+        When the server answers a request with a 401, the cached token is
+        no longer any good, so we want to get a new one, save it, and
+        retry the request with it.
         """
 
-        # The mock instance of the requests.post() method needs to only
-        # return an object which has a json() method which contains an
-        # 'access_token' attribute.  It doesn't matter what the attribute
-        # value is, as it's opaque to TeslaConnect.  Thus, we can easily
-        # simulate the response object's behavior with a simple lambda
-        # expression.  The mock instance of the requests.get() method is a
-        # little more complicated, as explained below.
+        mock_response_post = self.MockRequestResponse()
+        mock_response_post.json = lambda: {'access_token' : 'bar', 'expires_in' : 3888000}
+        post.return_value = mock_response_post
+
+        mock_response_rejected = self.MockRequestResponse()
+        mock_response_rejected.status_code = 401
+        mock_response_get = self.MockRequestResponse()
+        mock_response_get.json = lambda: {'count' : 0, 'response' : []}
+        get.side_effect = [mock_response_rejected, mock_response_get]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_config = dict(self._mock_config)
+            cache_config['token_cache'] = os.path.join(cache_dir, 'token.json')
+            with open(cache_config['token_cache'], 'w') as token_file:
+                json.dump({'username' : self._mock_config['username'], 'access_token' : 'foo',
+                           'expires_at' : time.time() + 86400}, token_file)
+
+            tesla = TeslaConnect(cache_config)
+            self.assertFalse(post.called)
+
+            vehicles = tesla.get_vehicles()
+
+            self.assertTrue(len(vehicles) == 0)
+            self.assertTrue(post.call_count == 1)
+            self.assertTrue(get.call_count == 2)
+            with open(cache_config['token_cache'], 'r') as token_file:
+                self.assertTrue(json.load(token_file)['access_token'] == 'bar')
+
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_token_cache_other_account(self, post, get):
+        """Doesn't reuse a cached token saved for another account.
+
+        When the username changes between runs, the token saved by the
+        earlier run belongs to the other account, so we want to log in
+        again rather than use it.
+        """
 
         mock_response_post = self.MockRequestResponse()
-        mock_response_post.json = lambda: {'access_token' : 'foo'}
-        mock_post.return_value = mock_response_post
+        mock_response_post.json = lambda: {'access_token' : 'bar', 'expires_in' : 3888000}
+        post.return_value = mock_response_post
 
-        class MockRequestResponseGet(self.MockRequestResponse):
-            """Class implementing the response behavior of requests.get().
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_config = dict(self._mock_config)
+            cache_config['token_cache'] = os.path.join(cache_dir, 'token.json')
+            with open(cache_config['token_cache'], 'w') as token_file:
+                json.dump({'username' : 'you@yourplace.com', 'access_token' : 'foo',
+                           'expires_at' : time.time() + 86400}, token_file)
 
-            The mock instance of the requests.get() method is a little more
-            complicated because we call it multiple times in get_vehicles():
-            once to get the list of vehicles in the user's Tesla account,
-            and then once more for each vehicle, to see if it's enabled for
-            mobile access.
-            """
+            tesla = TeslaConnect(cache_config)
 
-            def __init__(self, mock_get):
-                self._mock_get = mock_get
-
-            def json(self):
-                if self._mock_get.call_count == 1:
-                    return {
-                        'count' : 2,
-                        'response' : [
-                            {
-                                'id_s' : '111',
-                                'display_name' : 'foo',
-                                'in_service' : True
-                            },
-                            {
-                                'id_s' : '222',
-                                'display_name' : 'bar',
-                                'in_service' : False
-                            }
-                        ]
-                    }
-                elif self._mock_get.call_count > 1:
-                    return {
-                        'response' : True
-                    }
-
-        mock_response_get = MockRequestResponseGet(mock_get)
-        mock_get.return_value = mock_response_get
+            self.assertTrue(post.call_count == 1)
+            self.assertTrue(tesla._session.headers['Authorization'] == 'Bearer bar')
 
-        tesla = TeslaConnect(self._mock_config)
-        vehicles = tesla.get_vehicles()
+    @patch.multiple(requests.Session, post=DEFAULT, get=DEFAULT)
+    def test_token_cache_bare_file_name(self, post, get):
+        """Saves the token when the cache file is a bare file name.
 
-        self.assertTrue(len(vehicles) == 1)
+        A token cache file without a directory goes in the current
+        directory, and we want the token saved there.
+        """
+
+        mock_response_post = self.MockRequestResponse()
+        mock_response_post.json = lambda: {'access_token' : 'foo', 'expires_in' : 3888000}
+        post.return_value = mock_response_post
+
+        cache_config = dict(self._mock_config)
+        cache_config['token_cache'] = 'token.json'
+
+        original_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.chdir(cache_dir)
+            try:
+                TeslaConnect(cache_config)
+                self.assertTrue(os.path.isfile('token.json'))
+            finally:
+                os.chdir(original_dir)
 
     def tearDown(self):
         pass
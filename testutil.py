@@ -0,0 +1,15 @@
+"""Helpers shared by the test suites."""
+
+import json
+
+
+def text_only_loads(text):
+    """Parse JSON the way the standard library does before Python 3.6.
+
+    Those versions of json.loads() only accept text, so this rejects
+    bytes in the same way, wherever the tests run.
+    """
+
+    if not isinstance(text, str):
+        raise TypeError('the JSON object must be str, not ' + repr(type(text).__name__))
+    return json.loads(text)